@@ -10,6 +10,7 @@ Usage:
     python prompt_tester.py --photo path.jpg   # Use custom photo
     python prompt_tester.py --card             # Test card prompt only
     python prompt_tester.py --scene            # Test scene prompt only
+    python prompt_tester.py --batch file.txt   # Run prompts from a file concurrently
 
 Output:
     output/card_TIMESTAMP.png
@@ -18,12 +19,34 @@ Output:
 
 import os
 import sys
+import json
+import mmap
 import base64
+import shutil
+import struct
+import hashlib
 import argparse
 import mimetypes
-from datetime import datetime
+import itertools
+import threading
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from math import gcd
 from pathlib import Path
 
+# Optional: isal's vectorized DEFLATE decompresses the multi-MB gzip
+# responses 2-3x faster than stdlib zlib. Patched in before requests
+# (urllib3) binds its decoders.
+try:
+    import zlib
+    from isal import isal_zlib
+    zlib.decompress = isal_zlib.decompress
+    zlib.decompressobj = isal_zlib.decompressobj
+except ImportError:
+    pass
+
 try:
     import requests
 except ImportError:
@@ -31,6 +54,54 @@ except ImportError:
     print("Install it with: pip install requests")
     sys.exit(1)
 
+# Optional: pybase64 links against libbase64's SIMD (AVX2/NEON) kernels,
+# which is a big win for the multi-MB photos/PNGs we shuttle around.
+try:
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+# Optional: orjson serializes the payload (dominated by one huge base64
+# string) at ~GB/s vs stdlib json's character-by-character escape scan.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: httpx powers the async --batch mode (HTTP/2 multiplexing
+# when the h2 package is installed too).
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+def _b64encode_str(data) -> str:
+    """Base64-encode bytes to str, using SIMD if pybase64 is available."""
+    if pybase64 is not None:
+        return pybase64.b64encode_as_string(data)
+    return base64.b64encode(data).decode("utf-8")
+
+
+def _b64decode(data) -> bytes:
+    """Base64-decode, using SIMD (with validation) if pybase64 is available."""
+    if pybase64 is not None:
+        return pybase64.b64decode(data, validate=True)
+    return base64.b64decode(data)
+
+
+def _decode_b64_to_file(base64_data: str, output_path: str,
+                        chunk_chars: int = 1 << 17):
+    """Decode base64 straight into a file in aligned chunks.
+
+    Keeps peak memory at ~one chunk instead of materializing the whole
+    decoded PNG alongside its base64 source. chunk_chars must stay a
+    multiple of 4 so every slice is a valid base64 block.
+    """
+    with open(output_path, "wb") as f:
+        for i in range(0, len(base64_data), chunk_chars):
+            f.write(_b64decode(base64_data[i:i + chunk_chars]))
+
 # =============================================================================
 # CONFIGURATION
 # =============================================================================
@@ -39,6 +110,18 @@ OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
 DEFAULT_TEST_PHOTO = "test_photo.jpg"
 OUTPUT_FOLDER = "output"
 DEFAULT_MODEL = "bytedance-seed/seedream-4.5"
+_DEFAULT_MIME = "image/png"
+
+# Below this size the fixed mmap syscall cost outweighs a plain read.
+_MMAP_THRESHOLD = 64 * 1024
+
+# Output filename suffix: epoch seconds plus a per-process counter —
+# cheaper than strftime and collision-free within one second.
+_counter = itertools.count()
+
+
+def _output_suffix() -> str:
+    return f"{int(time.time())}_{next(_counter)}"
 
 # Output dimensions
 CARD_WIDTH = 1728
@@ -46,29 +129,65 @@ CARD_HEIGHT = 2304
 SCENE_WIDTH = 2560
 SCENE_HEIGHT = 1440
 
+_CARD_DIV = gcd(CARD_WIDTH, CARD_HEIGHT)
+CARD_AR = f"{CARD_WIDTH // _CARD_DIV}:{CARD_HEIGHT // _CARD_DIV}"
+_SCENE_DIV = gcd(SCENE_WIDTH, SCENE_HEIGHT)
+SCENE_AR = f"{SCENE_WIDTH // _SCENE_DIV}:{SCENE_HEIGHT // _SCENE_DIV}"
+
+# Pre-built (image_size, image_config) payload fragments for the only
+# two output sizes this tool requests.
+_SIZE_CONFIGS = {
+    (CARD_WIDTH, CARD_HEIGHT): (
+        {"width": CARD_WIDTH, "height": CARD_HEIGHT},
+        {"aspect_ratio": CARD_AR},
+    ),
+    (SCENE_WIDTH, SCENE_HEIGHT): (
+        {"width": SCENE_WIDTH, "height": SCENE_HEIGHT},
+        {"aspect_ratio": SCENE_AR},
+    ),
+}
+
+# Shared session: keeps the TLS connection to OpenRouter alive across
+# prompts instead of paying DNS + TLS setup (~100-300ms) per request.
+_SESSION = requests.Session()
+_SESSION.headers.update({
+    "HTTP-Referer": "https://sprite-forge.app",
+    "X-Title": "SPRITE FORGE Prompt Tester"
+})
+_SESSION.mount(
+    "https://",
+    requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+)
+
 
 # =============================================================================
 # CORE FUNCTIONS
 # =============================================================================
 
+@lru_cache(maxsize=1)
 def load_env():
-    """Load environment variables from .env.local"""
+    """Load environment variables from .env.local (read once per process)."""
     env_path = Path(__file__).parent.parent / ".env.local"
-    env_vars = {}
+    if not env_path.exists():
+        return {}
 
-    if env_path.exists():
-        with open(env_path, "r") as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    env_vars[key.strip()] = value.strip()
+    return {
+        key.strip(): value.strip()
+        for key, sep, value in (
+            line.partition("=") for line in env_path.read_text().splitlines()
+        )
+        if sep and key.strip() and not key.lstrip().startswith("#")
+    }
 
-    return env_vars
 
+def load_image(image_path: str) -> tuple[str, str, bytes]:
+    """Load image and return (data_uri, mime_type, photo_hash).
 
-def load_image(image_path: str) -> tuple[str, str]:
-    """Load image and return (base64_data, mime_type)"""
+    Builds the full "data:<mime>;base64,<data>" string in one pass so we
+    never hold a separate bare-base64 copy of a multi-MB photo alongside
+    the final URI. photo_hash is the sha256 of the raw file bytes, used
+    as part of the response-cache key.
+    """
     path = Path(image_path)
 
     if not path.exists():
@@ -78,82 +197,204 @@ def load_image(image_path: str) -> tuple[str, str]:
     if not mime_type or not mime_type.startswith("image/"):
         mime_type = "image/jpeg"
 
+    prefix = f"data:{mime_type};base64,".encode("ascii")
+    encode = pybase64.b64encode if pybase64 is not None else base64.b64encode
+
+    # mmap lets the encoder and hash read page-cache pages directly,
+    # skipping a full-file-size heap copy for the usual multi-MB photo.
+    buf = bytearray(prefix)
     with open(path, "rb") as f:
-        image_data = base64.b64encode(f.read()).decode("utf-8")
+        if os.fstat(f.fileno()).st_size >= _MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                buf += encode(mm)
+                digest = hashlib.sha256(mm).digest()
+        else:
+            image_data = f.read()
+            buf += encode(image_data)
+            digest = hashlib.sha256(image_data).digest()
 
-    return image_data, mime_type
+    return buf.decode("ascii"), mime_type, digest
 
 
-def generate_image(
-    api_key: str,
-    model: str,
-    image_base64: str,
-    mime_type: str,
-    prompt: str,
-    timeout: int = 120,
-    width: int = None,
-    height: int = None,
-    debug: bool = False
-) -> dict:
-    """Call OpenRouter API to generate an image."""
+def _upload_photo(files_api_url: str, api_key: str, photo_path: Path,
+                  mime_type: str, timeout: int = 60):
+    """Upload the raw photo once and return its hosted URL, or None.
 
-    # Prepend dimension instructions to prompt
-    dimension_instruction = ""
-    if width and height:
-        orientation = "portrait (taller than wide)" if height > width else "landscape (wider than tall)"
-        dimension_instruction = f"""OUTPUT IMAGE SPECIFICATIONS:
+    Referencing an uploaded file by URL replaces the 1.33x-inflated
+    base64 copy of the photo in every subsequent request payload with a
+    ~100-byte string. Any failure falls back to inline base64.
+    """
+    try:
+        with open(photo_path, "rb") as f:
+            response = _SESSION.post(
+                files_api_url,
+                headers={"Authorization": f"Bearer {api_key}"},
+                files={"file": (photo_path.name, f, mime_type)},
+                timeout=timeout
+            )
+    except requests.RequestException as e:
+        print(f"NOTE: photo upload failed ({e}); using inline base64")
+        return None
+
+    if not response.ok:
+        print(f"NOTE: photo upload failed (HTTP {response.status_code}); "
+              "using inline base64")
+        return None
+
+    data = orjson.loads(response.content) if orjson is not None else response.json()
+    if isinstance(data, dict):
+        for container in (data, data.get("data")):
+            if isinstance(container, dict):
+                for key in ("url", "signed_url"):
+                    if url := container.get(key):
+                        return url
+
+    print("NOTE: upload response had no URL; using inline base64")
+    return None
+
+
+def _build_full_prompt(prompt: str, width: int, height: int) -> str:
+    """Prepend dimension instructions to the prompt when a size is set."""
+    if not (width and height):
+        return prompt
+
+    orientation = "portrait (taller than wide)" if height > width else "landscape (wider than tall)"
+    return f"""OUTPUT IMAGE SPECIFICATIONS:
 - Exact dimensions: {width}x{height} pixels
 - Aspect ratio: {width}:{height}
 - Orientation: {orientation}
 - DO NOT generate a square image
 
-"""
+""" + prompt
 
-    full_prompt = dimension_instruction + prompt
 
-    payload = {
+def _apply_size(payload: dict, width: int, height: int):
+    """Set (or clear) the payload's image_size/image_config fields.
+
+    V2: image_size object + image_config.aspect_ratio (no conflicting
+    presets). We intentionally do NOT include an image_config.image_size
+    preset as it can conflict with explicit dimensions on some providers.
+    """
+    if width and height:
+        size_config = _SIZE_CONFIGS.get((width, height))
+        if size_config is None:
+            divisor = gcd(width, height)
+            size_config = (
+                {"width": width, "height": height},
+                {"aspect_ratio": f"{width // divisor}:{height // divisor}"},
+            )
+
+        # Seedream format: image_size object (primary authority for
+        # dimensions) plus an aspect_ratio hint, assigned by reference.
+        payload["image_size"], payload["image_config"] = size_config
+    else:
+        payload.pop("image_size", None)
+        payload.pop("image_config", None)
+
+
+def _new_payload(model: str, image_part: dict) -> dict:
+    """Build a request payload skeleton around a shared image part.
+
+    The nested messages/content structure is allocated once per payload;
+    generate_image then only swaps the prompt text and size fields.
+    """
+    return {
         "model": model,
         "messages": [
             {
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": full_prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:{mime_type};base64,{image_base64}"
-                        }
-                    }
+                    {"type": "text", "text": None},
+                    image_part
                 ]
             }
         ],
         "max_tokens": 4096
     }
 
-    # Add image size if specified
-    # V2: image_size object + image_config.aspect_ratio (no conflicting presets)
-    if width and height:
-        from math import gcd
-        divisor = gcd(width, height)
-        aspect_ratio = f"{width // divisor}:{height // divisor}"
-
-        # Seedream format: image_size object (primary authority for dimensions)
-        payload["image_size"] = {
-            "width": width,
-            "height": height
-        }
-        # Add aspect_ratio hint but NOT image_size preset
-        payload["image_config"] = {
-            "aspect_ratio": aspect_ratio
-        }
-        # Note: We intentionally do NOT include image_config.image_size preset
-        # as it can conflict with explicit dimensions on some providers
+
+def generate_image(
+    api_key: str,
+    model: str,
+    image_part: dict,
+    prompt: str,
+    timeout: int = 120,
+    width: int = None,
+    height: int = None,
+    debug: bool = False,
+    output_path: str = None,
+    photo_hash: bytes = None,
+    cache_dir: Path = None,
+    semantic_cache: "_SemanticCache" = None,
+    payload: dict = None
+) -> dict:
+    """Call OpenRouter API to generate an image.
+
+    When output_path is given and the response carries a data: URL, the
+    image is decoded straight to that file (no full-size bytes copy in
+    the result) and the returned dict has "path" instead of
+    "image_base64".
+
+    When photo_hash and cache_dir are given, responses are cached on
+    disk keyed on (prompt, photo, dimensions, model); resubmitting the
+    exact same prompt skips the API round-trip entirely.
+    """
+
+    full_prompt = _build_full_prompt(prompt, width, height)
+
+    cached_path = None
+    if photo_hash is not None and cache_dir is not None:
+        key = hashlib.blake2b(
+            full_prompt.encode()
+            + photo_hash
+            + struct.pack("<II", width or 0, height or 0)
+            + model.encode(),
+            digest_size=16
+        ).hexdigest()
+        cached_path = cache_dir / f"{key}.png"
+        if cached_path.exists():
+            if debug:
+                print(f"[DEBUG] Cache hit: {cached_path}")
+            if output_path:
+                shutil.copyfile(cached_path, output_path)
+                return {
+                    "success": True,
+                    "path": output_path,
+                    "mime_type": _DEFAULT_MIME,
+                    "cached": True
+                }
+            return {
+                "success": True,
+                "image_base64": _b64encode_str(cached_path.read_bytes()),
+                "mime_type": _DEFAULT_MIME,
+                "cached": True
+            }
+
+    pending_embed = None
+    if semantic_cache is not None and photo_hash is not None and output_path:
+        hit, pending_embed = semantic_cache.lookup(
+            full_prompt, photo_hash, width, height, model)
+        if hit:
+            if debug:
+                print(f"[DEBUG] Semantic cache hit: {hit}")
+            shutil.copyfile(hit, output_path)
+            return {
+                "success": True,
+                "path": output_path,
+                "mime_type": _DEFAULT_MIME,
+                "cached": True
+            }
+
+    # Callers in a loop pass their own reusable payload (one per worker
+    # thread); only the prompt text and size fields change per call.
+    if payload is None:
+        payload = _new_payload(model, image_part)
+    payload["messages"][0]["content"][0]["text"] = full_prompt
+    _apply_size(payload, width, height)
 
     headers = {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}",
-        "HTTP-Referer": "https://sprite-forge.app",
-        "X-Title": "SPRITE FORGE Prompt Tester"
+        "Authorization": f"Bearer {api_key}"
     }
 
     if debug:
@@ -162,12 +403,20 @@ def generate_image(
         print(f"  {debug_payload}")
         print(f"  Prompt length: {len(full_prompt)} chars")
 
-    response = requests.post(
-        OPENROUTER_API_URL,
-        headers=headers,
-        json=payload,
-        timeout=timeout
-    )
+    if orjson is not None:
+        response = _SESSION.post(
+            OPENROUTER_API_URL,
+            headers=headers,
+            data=orjson.dumps(payload),
+            timeout=timeout
+        )
+    else:
+        response = _SESSION.post(
+            OPENROUTER_API_URL,
+            headers=headers,
+            json=payload,
+            timeout=timeout
+        )
 
     if debug:
         print(f"[DEBUG] Response status: {response.status_code}")
@@ -178,65 +427,109 @@ def generate_image(
             "error": f"HTTP {response.status_code}: {response.text[:200]}"
         }
 
-    data = response.json()
+    # response.content skips requests' str-decode path; orjson's SIMD
+    # UTF-8 validation chews through the multi-MB base64 string.
+    if orjson is not None:
+        data = orjson.loads(response.content)
+    else:
+        data = response.json()
 
-    if debug:
-        print(f"[DEBUG] Response keys: {list(data.keys())}")
-        if "choices" in data and len(data["choices"]) > 0:
-            msg = data["choices"][0].get("message", {})
-            print(f"[DEBUG] Message keys: {list(msg.keys())}")
-            if "images" in msg:
-                print(f"[DEBUG] Images count: {len(msg['images'])}")
+    result = _extract_image(data, output_path, debug=debug)
+
+    if result["success"] and "path" in result:
+        if cached_path is not None:
+            # Publish atomically: an interrupted copy must never leave a
+            # truncated PNG that every future hit would then serve.
+            tmp_path = cached_path.with_name(cached_path.name + ".tmp")
+            shutil.copyfile(output_path, tmp_path)
+            os.replace(tmp_path, cached_path)
+        if pending_embed is not None:
+            # Point the embedding at the stable cache copy when there is
+            # one; output files get renamed.
+            semantic_cache.insert(pending_embed, cached_path or output_path)
+
+    return result
 
-    message = data.get("choices", [{}])[0].get("message", {})
 
-    # Check message.images[] first (Gemini/Seedream format)
-    images = message.get("images", [])
-    if images and len(images) > 0:
+def _extract_image(data: dict, output_path: str = None,
+                   debug: bool = False) -> dict:
+    """Pull the generated image out of a parsed API response.
+
+    Shared by the sync and async request paths; handles every response
+    shape the providers have been seen to return.
+    """
+    try:
+        message = data["choices"][0]["message"]
+    except (KeyError, IndexError):
+        message = {}
+
+    if debug:
+        print(f"[DEBUG] Response keys: {list(data.keys())}")
+        if message:
+            print(f"[DEBUG] Message keys: {list(message.keys())}")
+            if "images" in message:
+                print(f"[DEBUG] Images count: {len(message['images'])}")
+
+    # Hot path first: Seedream/Gemini return images[0].image_url.url as
+    # a data: URL. try/except instead of chained .get(x, default) so no
+    # throwaway default dicts are allocated per response.
+    if images := message.get("images"):
         img = images[0]
 
-        if "image_url" in img and "url" in img["image_url"]:
+        try:
             url = img["image_url"]["url"]
-            if url.startswith("data:"):
-                parts = url.split(",", 1)
-                if len(parts) == 2:
-                    mime = parts[0].split(":")[1].split(";")[0]
+        except (KeyError, TypeError):
+            # TypeError: some providers return image_url as a plain
+            # string rather than an object.
+            url = None
+
+        if url and url.startswith("data:"):
+            parts = url.split(",", 1)
+            if len(parts) == 2:
+                mime = parts[0].split(":")[1].split(";")[0]
+                if output_path:
+                    _decode_b64_to_file(parts[1], output_path)
                     return {
                         "success": True,
-                        "image_base64": parts[1],
+                        "path": output_path,
                         "mime_type": mime
                     }
+                return {
+                    "success": True,
+                    "image_base64": parts[1],
+                    "mime_type": mime
+                }
 
-        if "inline_data" in img:
+        if inline := img.get("inline_data"):
             return {
                 "success": True,
-                "image_base64": img["inline_data"].get("data", ""),
-                "mime_type": img["inline_data"].get("mime_type", "image/png")
+                "image_base64": inline.get("data", ""),
+                "mime_type": inline.get("mime_type", _DEFAULT_MIME)
             }
 
         if "data" in img:
             return {
                 "success": True,
                 "image_base64": img["data"],
-                "mime_type": img.get("mime_type", "image/png")
+                "mime_type": img.get("mime_type", _DEFAULT_MIME)
             }
 
     # Check content array
     content = message.get("content", "")
     if isinstance(content, list):
         for item in content:
-            if item.get("type") in ["output_image", "image", "image_url"]:
-                if "inline_data" in item:
+            if item.get("type") in ("output_image", "image", "image_url"):
+                if inline := item.get("inline_data"):
                     return {
                         "success": True,
-                        "image_base64": item["inline_data"].get("data", ""),
-                        "mime_type": item["inline_data"].get("mime_type", "image/png")
+                        "image_base64": inline.get("data", ""),
+                        "mime_type": inline.get("mime_type", _DEFAULT_MIME)
                     }
                 if "data" in item:
                     return {
                         "success": True,
                         "image_base64": item["data"],
-                        "mime_type": item.get("mime_type", "image/png")
+                        "mime_type": item.get("mime_type", _DEFAULT_MIME)
                     }
 
     if isinstance(content, str) and content:
@@ -251,43 +544,314 @@ def generate_image(
     }
 
 
+class _SemanticCache:
+    """Embedding-based near-duplicate prompt cache.
+
+    Exact-match caching misses as soon as one word changes. This keeps a
+    usearch index of fastembed (BAAI/bge-small, CPU-only) prompt
+    embeddings; a prompt whose cosine similarity to a stored one clears
+    the threshold — for the same (photo, dimensions, model) — is served
+    from the stored PNG instead of a fresh generation.
+    """
+
+    def __init__(self, cache_dir: Path, threshold: float):
+        from fastembed import TextEmbedding
+        from usearch.index import Index
+
+        self.threshold = threshold
+        self.dir = cache_dir / "semantic"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.dir / "prompts.usearch"
+        self.meta_path = self.dir / "entries.json"
+        self._lock = threading.Lock()
+
+        self.embedder = TextEmbedding("BAAI/bge-small-en-v1.5")
+        probe = next(iter(self.embedder.embed(["probe"])))
+        self.index = Index(ndim=len(probe), metric="cos")
+        if self.index_path.exists():
+            self.index.load(str(self.index_path))
+
+        self.entries = {}
+        if self.meta_path.exists():
+            self.entries = {
+                int(k): v for k, v in json.loads(self.meta_path.read_text()).items()
+            }
+
+    @staticmethod
+    def _tag(photo_hash: bytes, width: int, height: int, model: str) -> str:
+        return hashlib.blake2b(
+            photo_hash + struct.pack("<II", width or 0, height or 0) + model.encode(),
+            digest_size=8
+        ).hexdigest()
+
+    def lookup(self, prompt: str, photo_hash: bytes, width: int, height: int,
+               model: str):
+        """Return (cached_png_path_or_None, pending_insert_state)."""
+        emb = next(iter(self.embedder.embed([prompt])))
+        tag = self._tag(photo_hash, width, height, model)
+
+        with self._lock:
+            if len(self.index):
+                for match in self.index.search(emb, 8):
+                    # usearch cos metric reports distance = 1 - similarity
+                    if 1.0 - match.distance < self.threshold:
+                        break
+                    entry = self.entries.get(int(match.key))
+                    if entry and entry["tag"] == tag and Path(entry["path"]).exists():
+                        return entry["path"], None
+
+        return None, (emb, tag)
+
+    def insert(self, pending, png_path):
+        emb, tag = pending
+        with self._lock:
+            key = max(self.entries, default=-1) + 1
+            self.index.add(key, emb)
+            self.entries[key] = {"tag": tag, "path": str(png_path)}
+            self.index.save(str(self.index_path))
+            self.meta_path.write_text(json.dumps(self.entries))
+
+
+async def _agenerate_image(client, api_key: str, model: str, image_part: dict,
+                           prompt: str, width: int = None, height: int = None,
+                           output_path: str = None, timeout: int = 120) -> dict:
+    """Async mirror of generate_image for batch mode (no caching)."""
+    payload = _new_payload(model, image_part)
+    payload["messages"][0]["content"][0]["text"] = _build_full_prompt(prompt, width, height)
+    _apply_size(payload, width, height)
+
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+
+    if orjson is not None:
+        response = await client.post(
+            OPENROUTER_API_URL, headers=headers,
+            content=orjson.dumps(payload), timeout=timeout)
+    else:
+        response = await client.post(
+            OPENROUTER_API_URL, headers=headers,
+            json=payload, timeout=timeout)
+
+    if response.status_code >= 400:
+        return {
+            "success": False,
+            "error": f"HTTP {response.status_code}: {response.text[:200]}"
+        }
+
+    if orjson is not None:
+        data = orjson.loads(response.content)
+    else:
+        data = response.json()
+
+    return _extract_image(data, output_path)
+
+
+async def run_batch(api_key: str, model: str, image_data_uri: str,
+                    output_dir: Path, prompts: list, mode: str = "both",
+                    timeout: int = 120) -> bool:
+    """Run a batch of prompts concurrently over one pooled connection."""
+    image_part = {"type": "image_url", "image_url": {"url": image_data_uri}}
+    kinds = ("card", "scene") if mode == "both" else (mode,)
+
+    print(f"\nBatch: {len(prompts)} prompt(s) x {len(kinds)} output(s)...")
+
+    client_kwargs = {
+        "headers": {
+            "HTTP-Referer": "https://sprite-forge.app",
+            "X-Title": "SPRITE FORGE Prompt Tester"
+        },
+        "limits": httpx.Limits(max_connections=4),
+    }
+    try:
+        client = httpx.AsyncClient(http2=True, **client_kwargs)
+    except ImportError:  # h2 not installed — plain HTTP/1.1 keep-alive
+        client = httpx.AsyncClient(**client_kwargs)
+
+    # pool=None: with 4 connections and N x 2 queued generations taking
+    # tens of seconds each, waiting for a free connection is expected —
+    # only the request itself should be bounded by the timeout.
+    http_timeout = httpx.Timeout(timeout, pool=None)
+
+    async def _one(idx: int, kind: str, prompt: str) -> bool:
+        if kind == "card":
+            width, height = CARD_WIDTH, CARD_HEIGHT
+        else:
+            width, height = SCENE_WIDTH, SCENE_HEIGHT
+        out_path = output_dir / f"{kind}_batch{idx:03d}_{_output_suffix()}.png"
+        try:
+            result = await _agenerate_image(
+                client, api_key, model, image_part, prompt,
+                width, height, str(out_path), http_timeout)
+        except Exception as e:
+            # One dead request must not take the rest of the batch down.
+            print(f"[{idx}] FAILED ({kind.upper()}): {type(e).__name__}: {e}")
+            return False
+        if result["success"]:
+            if "image_base64" in result:
+                save_image(result["image_base64"], str(out_path))
+            print(f"[{idx}] SUCCESS ({kind.upper()}): {out_path}")
+            return True
+        print(f"[{idx}] FAILED ({kind.upper()}): {result['error']}")
+        return False
+
+    async with client:
+        outcomes = await asyncio.gather(*(
+            _one(idx, kind, prompt)
+            for idx, prompt in enumerate(prompts)
+            for kind in kinds
+        ))
+
+    failed = outcomes.count(False)
+    print(f"\nBatch done: {len(outcomes) - failed}/{len(outcomes)} succeeded")
+    return failed == 0
+
+
 def save_image(base64_data: str, output_path: str):
-    """Save base64 image data to file."""
-    image_bytes = base64.b64decode(base64_data)
-    with open(output_path, "wb") as f:
-        f.write(image_bytes)
+    """Save base64 image data to file.
 
+    Fallback for response shapes that generate_image could not stream to
+    disk itself (inline_data / raw data fields).
+    """
+    _decode_b64_to_file(base64_data, output_path)
 
-def get_multiline_input(prompt_text: str) -> str:
-    """Get multiline input from user. End with empty line or Ctrl+D."""
-    print(prompt_text)
-    print("(Paste your prompt, then press Enter twice to submit)")
-    print("-" * 40)
 
+_COMMANDS = frozenset({"quit", "exit", "q", "card", "scene", "both"})
+
+
+def _as_command(text: str):
+    """Return the command word if text is one, else None.
+
+    Only tiny single-token inputs can be commands, so this never
+    lowercases a multi-KB pasted prompt just to compare it.
+    """
+    if len(text) <= 8 and " " not in text:
+        cmd = text.strip().lower()
+        if cmd in _COMMANDS:
+            return cmd
+    return None
+
+
+# Bracketed paste: with it enabled the terminal wraps a paste in
+# \x1b[200~ ... \x1b[201~, so a multi-KB prompt arrives as a few big
+# os.read chunks instead of one readline round-trip per pasted line.
+_PASTE_ON = "\x1b[?2004h"
+_PASTE_OFF = "\x1b[?2004l"
+_PASTE_START = b"\x1b[200~"
+_PASTE_END = b"\x1b[201~"
+
+
+def _read_lines_fallback() -> str:
+    """Line-at-a-time reader for non-TTY stdin (pipes, redirects)."""
     lines = []
-    empty_count = 0
 
     try:
         while True:
             line = input()
-            if line == "":
-                empty_count += 1
-                if empty_count >= 1:  # Single empty line to submit
-                    break
-                lines.append(line)
-            else:
-                empty_count = 0
-                lines.append(line)
+            if not line:  # First empty line submits
+                break
+            lines.append(line)
     except EOFError:
         pass
 
     return "\n".join(lines).strip()
 
 
-def run_interactive(api_key: str, model: str, image_base64: str, mime_type: str,
-                    output_dir: Path, mode: str = "both", timeout: int = 120, debug: bool = False):
+def _read_tty_input() -> str:
+    """Raw-mode reader: slurps whole paste bursts in single syscalls."""
+    import termios
+    import tty
+
+    fd = sys.stdin.fileno()
+    old_attrs = termios.tcgetattr(fd)
+    buf = bytearray()
+    in_paste = False
+
+    sys.stdout.write(_PASTE_ON)
+    sys.stdout.flush()
+    try:
+        tty.setcbreak(fd)
+        while True:
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                break
+            if not in_paste and chunk.startswith(b"\x04"):  # Ctrl+D
+                break
+
+            buf += chunk
+
+            if in_paste:
+                # Inside a paste: no editing, just collect and echo.
+                # Compare marker counts — a plain membership test goes
+                # stale once the first paste's markers are in the buffer.
+                sys.stdout.write(chunk.decode("utf-8", "replace"))
+                sys.stdout.flush()
+                if buf.count(_PASTE_END) >= buf.count(_PASTE_START):
+                    in_paste = False
+                continue
+
+            if buf.count(_PASTE_START) > buf.count(_PASTE_END):
+                in_paste = True
+                sys.stdout.write(chunk.decode("utf-8", "replace"))
+                sys.stdout.flush()
+                continue
+
+            if chunk in (b"\x7f", b"\x08"):  # backspace on typed input
+                del buf[-1:]  # drop the backspace byte itself
+                if buf and not buf.endswith(b"\n"):
+                    del buf[-1:]
+                    sys.stdout.write("\b \b")
+                    sys.stdout.flush()
+                continue
+
+            sys.stdout.write(chunk.decode("utf-8", "replace"))
+            sys.stdout.flush()
+
+            if buf.endswith(b"\n\n"):  # Enter twice to submit
+                break
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old_attrs)
+        sys.stdout.write(_PASTE_OFF)
+        sys.stdout.flush()
+
+    text = bytes(buf).replace(_PASTE_START, b"").replace(_PASTE_END, b"")
+    text = text.replace(b"\x04", b"").decode("utf-8", "replace")
+    return text.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+def get_multiline_input(prompt_text: str) -> str:
+    """Get multiline input from user. End with empty line or Ctrl+D."""
+    print(prompt_text)
+    print("(Paste your prompt, then press Enter twice to submit)")
+    print("-" * 40)
+
+    if sys.stdin.isatty():
+        try:
+            return _read_tty_input()
+        except (ImportError, OSError):
+            pass  # No termios (e.g. Windows) — fall back to readline.
+
+    return _read_lines_fallback()
+
+
+def run_interactive(api_key: str, model: str, image_data_uri: str,
+                    output_dir: Path, mode: str = "both", timeout: int = 120, debug: bool = False,
+                    photo_hash: bytes = None, cache_dir: Path = None,
+                    semantic_cache: _SemanticCache = None):
     """Run interactive prompt testing loop."""
 
+    # Build the image_url content part once; every prompt submission
+    # reuses it by reference instead of re-wrapping the multi-MB URI.
+    image_part = {"type": "image_url", "image_url": {"url": image_data_uri}}
+
+    # One reusable payload per output kind: the both-mode worker threads
+    # each mutate only their own clone, and both share image_part.
+    payloads = {
+        "card": _new_payload(model, image_part),
+        "scene": _new_payload(model, image_part),
+    }
+
     print("\n" + "=" * 60)
     print("INTERACTIVE MODE")
     print("=" * 60)
@@ -313,8 +877,8 @@ def run_interactive(api_key: str, model: str, image_base64: str, mime_type: str,
                 continue
 
             # Check for commands
-            cmd = card_prompt.lower().strip()
-            if cmd in ["quit", "exit", "q"]:
+            cmd = _as_command(card_prompt)
+            if cmd in ("quit", "exit", "q"):
                 print("\nGoodbye!")
                 break
             elif cmd == "card":
@@ -334,8 +898,8 @@ def run_interactive(api_key: str, model: str, image_base64: str, mime_type: str,
                 continue
 
             # Check for commands in scene prompt too
-            cmd = scene_prompt.lower().strip()
-            if cmd in ["quit", "exit", "q"]:
+            cmd = _as_command(scene_prompt)
+            if cmd in ("quit", "exit", "q"):
                 print("\nGoodbye!")
                 break
             elif cmd == "card":
@@ -347,49 +911,45 @@ def run_interactive(api_key: str, model: str, image_base64: str, mime_type: str,
                 print("Switched to SCENE mode")
                 continue
 
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            suffix = _output_suffix()
 
-            # Generate CARD
-            print(f"\nGenerating CARD ({CARD_WIDTH}x{CARD_HEIGHT})...")
-            result = generate_image(
-                api_key=api_key,
-                model=model,
-                image_base64=image_base64,
-                mime_type=mime_type,
-                prompt=card_prompt,
-                timeout=timeout,
-                width=CARD_WIDTH,
-                height=CARD_HEIGHT,
-                debug=debug
-            )
-
-            if result["success"]:
-                card_path = output_dir / f"card_{timestamp}.png"
-                save_image(result["image_base64"], str(card_path))
-                print(f"SUCCESS: {card_path}")
-            else:
-                print(f"FAILED: {result['error']}")
-
-            # Generate SCENE
-            print(f"\nGenerating SCENE ({SCENE_WIDTH}x{SCENE_HEIGHT})...")
-            result = generate_image(
-                api_key=api_key,
-                model=model,
-                image_base64=image_base64,
-                mime_type=mime_type,
-                prompt=scene_prompt,
-                timeout=timeout,
-                width=SCENE_WIDTH,
-                height=SCENE_HEIGHT,
-                debug=debug
-            )
-
-            if result["success"]:
-                scene_path = output_dir / f"scene_{timestamp}.png"
-                save_image(result["image_base64"], str(scene_path))
-                print(f"SUCCESS: {scene_path}")
-            else:
-                print(f"FAILED: {result['error']}")
+            def _gen(kind: str, prompt: str, width: int, height: int):
+                out_path = output_dir / f"{kind}_{suffix}.png"
+                result = generate_image(
+                    api_key=api_key,
+                    model=model,
+                    image_part=image_part,
+                    prompt=prompt,
+                    timeout=timeout,
+                    width=width,
+                    height=height,
+                    debug=debug,
+                    output_path=str(out_path),
+                    photo_hash=photo_hash,
+                    cache_dir=cache_dir,
+                    semantic_cache=semantic_cache,
+                    payload=payloads[kind]
+                )
+                return kind, out_path, result
+
+            # CARD and SCENE are independent API calls — run them in
+            # parallel so wall time is max(t_card, t_scene), not the sum.
+            print(f"\nGenerating CARD ({CARD_WIDTH}x{CARD_HEIGHT}) "
+                  f"and SCENE ({SCENE_WIDTH}x{SCENE_HEIGHT}) in parallel...")
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                futures = [
+                    pool.submit(_gen, "card", card_prompt, CARD_WIDTH, CARD_HEIGHT),
+                    pool.submit(_gen, "scene", scene_prompt, SCENE_WIDTH, SCENE_HEIGHT),
+                ]
+                for future in as_completed(futures):
+                    kind, out_path, result = future.result()
+                    if result["success"]:
+                        if "image_base64" in result:
+                            save_image(result["image_base64"], str(out_path))
+                        note = " from cache" if result.get("cached") else ""
+                        print(f"SUCCESS ({kind.upper()}{note}): {out_path}")
+                    else:
+                        print(f"FAILED ({kind.upper()}): {result['error']}")
 
         else:
             # Single mode: card or scene
@@ -401,8 +961,8 @@ def run_interactive(api_key: str, model: str, image_base64: str, mime_type: str,
                 continue
 
             # Check for commands
-            cmd = prompt.lower().strip()
-            if cmd in ["quit", "exit", "q"]:
+            cmd = _as_command(prompt)
+            if cmd in ("quit", "exit", "q"):
                 print("\nGoodbye!")
                 break
             elif cmd == "card":
@@ -418,49 +978,36 @@ def run_interactive(api_key: str, model: str, image_base64: str, mime_type: str,
                 print("Switched to BOTH mode (will ask for 2 prompts)")
                 continue
 
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
             if current_mode == "card":
-                print(f"\nGenerating CARD ({CARD_WIDTH}x{CARD_HEIGHT})...")
-                result = generate_image(
-                    api_key=api_key,
-                    model=model,
-                    image_base64=image_base64,
-                    mime_type=mime_type,
-                    prompt=prompt,
-                    timeout=timeout,
-                    width=CARD_WIDTH,
-                    height=CARD_HEIGHT,
-                    debug=debug
-                )
-
-                if result["success"]:
-                    card_path = output_dir / f"card_{timestamp}.png"
-                    save_image(result["image_base64"], str(card_path))
-                    print(f"SUCCESS: {card_path}")
-                else:
-                    print(f"FAILED: {result['error']}")
+                width, height = CARD_WIDTH, CARD_HEIGHT
+            else:
+                width, height = SCENE_WIDTH, SCENE_HEIGHT
 
-            elif current_mode == "scene":
-                print(f"\nGenerating SCENE ({SCENE_WIDTH}x{SCENE_HEIGHT})...")
-                result = generate_image(
-                    api_key=api_key,
-                    model=model,
-                    image_base64=image_base64,
-                    mime_type=mime_type,
-                    prompt=prompt,
-                    timeout=timeout,
-                    width=SCENE_WIDTH,
-                    height=SCENE_HEIGHT,
-                    debug=debug
-                )
+            print(f"\nGenerating {current_mode.upper()} ({width}x{height})...")
+            out_path = output_dir / f"{current_mode}_{_output_suffix()}.png"
+            result = generate_image(
+                api_key=api_key,
+                model=model,
+                image_part=image_part,
+                prompt=prompt,
+                timeout=timeout,
+                width=width,
+                height=height,
+                debug=debug,
+                output_path=str(out_path),
+                photo_hash=photo_hash,
+                cache_dir=cache_dir,
+                semantic_cache=semantic_cache,
+                payload=payloads[current_mode]
+            )
 
-                if result["success"]:
-                    scene_path = output_dir / f"scene_{timestamp}.png"
-                    save_image(result["image_base64"], str(scene_path))
-                    print(f"SUCCESS: {scene_path}")
-                else:
-                    print(f"FAILED: {result['error']}")
+            if result["success"]:
+                if "image_base64" in result:
+                    save_image(result["image_base64"], str(out_path))
+                note = " (from cache)" if result.get("cached") else ""
+                print(f"SUCCESS{note}: {out_path}")
+            else:
+                print(f"FAILED: {result['error']}")
 
         print("\n" + "-" * 40)
         print("Ready for next prompt (or type 'quit' to exit)")
@@ -482,8 +1029,17 @@ Examples:
     parser.add_argument("--card", action="store_true", help="Test card prompts only")
     parser.add_argument("--scene", action="store_true", help="Test scene prompts only")
     parser.add_argument("--model", help="Override model name", default=None)
+    parser.add_argument("--batch", metavar="FILE", default=None,
+                        help="Run all prompts from FILE (one per line, # comments) "
+                             "concurrently instead of interactive mode (needs httpx)")
     parser.add_argument("--timeout", type=int, default=120, help="Request timeout in seconds")
     parser.add_argument("--debug", action="store_true", help="Show debug output")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always call the API, even for previously seen prompts")
+    parser.add_argument("--semantic-cache-threshold", type=float, default=None,
+                        metavar="COS",
+                        help="Also serve near-duplicate prompts from cache at this "
+                             "cosine similarity (e.g. 0.97; needs fastembed + usearch)")
 
     args = parser.parse_args()
 
@@ -525,6 +1081,20 @@ Examples:
     output_dir = script_dir / OUTPUT_FOLDER
     output_dir.mkdir(exist_ok=True)
 
+    # Response cache: identical (prompt, photo, size, model) submissions
+    # are served from disk instead of a fresh API round-trip.
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = output_dir / ".cache"
+        cache_dir.mkdir(exist_ok=True)
+
+    semantic_cache = None
+    if args.semantic_cache_threshold and cache_dir is not None:
+        try:
+            semantic_cache = _SemanticCache(cache_dir, args.semantic_cache_threshold)
+        except ImportError:
+            print("NOTE: semantic cache disabled — install with: pip install fastembed usearch")
+
     # Load image
     print("\n" + "=" * 60)
     print("SPRITE FORGE — Prompt Tester")
@@ -535,22 +1105,66 @@ Examples:
     print("=" * 60)
 
     try:
-        image_base64, mime_type = load_image(str(photo_path))
-        print(f"Loaded image: {mime_type}, {len(image_base64)//1024}KB")
+        # With a files API configured, upload the raw photo once and put
+        # its URL in every payload instead of N inflated base64 copies.
+        hosted_url = None
+        files_api = env.get("OPENROUTER_FILES_API", "")
+        if files_api:
+            mime_guess, _ = mimetypes.guess_type(str(photo_path))
+            hosted_url = _upload_photo(
+                files_api, api_key, photo_path, mime_guess or "image/jpeg")
+
+        if hosted_url:
+            image_data_uri = hosted_url
+            photo_hash = hashlib.sha256(photo_path.read_bytes()).digest()
+            print(f"Uploaded photo: payloads reference {hosted_url}")
+        else:
+            image_data_uri, mime_type, photo_hash = load_image(str(photo_path))
+            print(f"Loaded image: {mime_type}, {len(image_data_uri)//1024}KB")
     except Exception as e:
         print(f"ERROR loading image: {e}")
         sys.exit(1)
 
+    # Batch mode: fire every prompt concurrently and exit
+    if args.batch:
+        if httpx is None:
+            print("ERROR: --batch requires the 'httpx' library.")
+            print("Install it with: pip install httpx")
+            sys.exit(1)
+        batch_path = Path(args.batch)
+        if not batch_path.exists():
+            print(f"ERROR: Batch file not found: {batch_path}")
+            sys.exit(1)
+        prompts = [
+            line.strip() for line in batch_path.read_text().splitlines()
+            if line.strip() and not line.lstrip().startswith("#")
+        ]
+        if not prompts:
+            print(f"ERROR: No prompts in {batch_path}")
+            sys.exit(1)
+        ok = asyncio.run(run_batch(
+            api_key=api_key,
+            model=model,
+            image_data_uri=image_data_uri,
+            output_dir=output_dir,
+            prompts=prompts,
+            mode=mode,
+            timeout=args.timeout
+        ))
+        sys.exit(0 if ok else 1)
+
     # Run interactive mode
     run_interactive(
         api_key=api_key,
         model=model,
-        image_base64=image_base64,
-        mime_type=mime_type,
+        image_data_uri=image_data_uri,
         output_dir=output_dir,
         mode=mode,
         timeout=args.timeout,
-        debug=args.debug
+        debug=args.debug,
+        photo_hash=photo_hash,
+        cache_dir=cache_dir,
+        semantic_cache=semantic_cache
     )
 
 
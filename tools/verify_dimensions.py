@@ -17,11 +17,66 @@ Exit codes:
 
 import os
 import sys
+import mmap
 import base64
+import struct
 import mimetypes
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from math import gcd
 from pathlib import Path
-from datetime import datetime
+import itertools
+import time
+
+# Optional: isal's vectorized DEFLATE decompresses the multi-MB gzip
+# responses 2-3x faster than stdlib zlib. Patched in before requests
+# (imported lazily in _get_session) binds its decoders.
+try:
+    import zlib
+    from isal import isal_zlib
+    zlib.decompress = isal_zlib.decompress
+    zlib.decompressobj = isal_zlib.decompressobj
+except ImportError:
+    pass
+
+# Optional: pybase64 links against libbase64's SIMD (AVX2/NEON) kernels.
+try:
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+# Optional: orjson serializes the base64-heavy payload at ~GB/s.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _b64encode_str(data) -> str:
+    """Base64-encode bytes to str, using SIMD if pybase64 is available."""
+    if pybase64 is not None:
+        return pybase64.b64encode_as_string(data)
+    return base64.b64encode(data).decode("utf-8")
+
+
+def _b64decode(data) -> bytes:
+    """Base64-decode, using SIMD (with validation) if pybase64 is available."""
+    if pybase64 is not None:
+        return pybase64.b64decode(data, validate=True)
+    return base64.b64decode(data)
+
+
+def _decode_b64_to_file(base64_data: str, output_path,
+                        chunk_chars: int = 1 << 17):
+    """Decode base64 straight into a file in aligned chunks.
+
+    Avoids holding the whole decoded PNG in memory next to its base64
+    source. chunk_chars must stay a multiple of 4.
+    """
+    with open(output_path, "wb") as f:
+        for i in range(0, len(base64_data), chunk_chars):
+            f.write(_b64decode(base64_data[i:i + chunk_chars]))
 
 # Expected dimensions (must match OUTPUT_DIMENSIONS in types.ts)
 CARD_WIDTH = 1728
@@ -29,34 +84,87 @@ CARD_HEIGHT = 2304
 SCENE_WIDTH = 2560
 SCENE_HEIGHT = 1440
 
+_CARD_DIV = gcd(CARD_WIDTH, CARD_HEIGHT)
+CARD_AR = f"{CARD_WIDTH // _CARD_DIV}:{CARD_HEIGHT // _CARD_DIV}"
+_SCENE_DIV = gcd(SCENE_WIDTH, SCENE_HEIGHT)
+SCENE_AR = f"{SCENE_WIDTH // _SCENE_DIV}:{SCENE_HEIGHT // _SCENE_DIV}"
+
+# Pre-built (image_size, image_config) payload fragments per output size.
+_SIZE_CONFIGS = {
+    (CARD_WIDTH, CARD_HEIGHT): (
+        {"width": CARD_WIDTH, "height": CARD_HEIGHT},
+        {"aspect_ratio": CARD_AR},
+    ),
+    (SCENE_WIDTH, SCENE_HEIGHT): (
+        {"width": SCENE_WIDTH, "height": SCENE_HEIGHT},
+        {"aspect_ratio": SCENE_AR},
+    ),
+}
+
 OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
 DEFAULT_MODEL = "bytedance-seed/seedream-4.5"
 
+# Below this size the fixed mmap syscall cost outweighs a plain read.
+_MMAP_THRESHOLD = 64 * 1024
+
+# Output filename suffix: epoch seconds plus a per-process counter —
+# cheaper than strftime and collision-free within one second.
+_counter = itertools.count()
+
+
+def _output_suffix() -> str:
+    return f"{int(time.time())}_{next(_counter)}"
+
 
+@lru_cache(maxsize=1)
 def load_env():
-    """Load environment variables from .env.local"""
+    """Load environment variables from .env.local (read once per process)."""
     env_path = Path(__file__).parent.parent / ".env.local"
-    env_vars = {}
-    if env_path.exists():
-        for line in open(env_path):
-            line = line.strip()
-            if line and not line.startswith("#") and "=" in line:
-                k, v = line.split("=", 1)
-                env_vars[k.strip()] = v.strip()
-    return env_vars
+    if not env_path.exists():
+        return {}
+    return {
+        k.strip(): v.strip()
+        for k, sep, v in (
+            line.partition("=") for line in env_path.read_text().splitlines()
+        )
+        if sep and k.strip() and not k.lstrip().startswith("#")
+    }
+
+
+# Lazily-created shared session so the CARD and SCENE generations reuse
+# one TLS connection (requests stays an optional dep for --quick mode).
+_session = None
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        try:
+            import requests
+        except ImportError:
+            print("ERROR: requests library not installed")
+            sys.exit(2)
+        _session = requests.Session()
+        _session.headers.update({
+            "HTTP-Referer": "https://sprite-forge.app",
+            "X-Title": "SPRITE FORGE Dimension Test"
+        })
+        _session.mount(
+            "https://",
+            requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        )
+    return _session
 
 
 def generate_image(api_key, model, image_b64, mime, prompt, width, height):
     """Generate image with explicit dimensions (Seedream format)."""
-    try:
-        import requests
-    except ImportError:
-        print("ERROR: requests library not installed")
-        sys.exit(2)
-
-    from math import gcd
-    divisor = gcd(width, height)
-    aspect_ratio = f"{width // divisor}:{height // divisor}"
+    size_config = _SIZE_CONFIGS.get((width, height))
+    if size_config is None:
+        divisor = gcd(width, height)
+        size_config = (
+            {"width": width, "height": height},
+            {"aspect_ratio": f"{width // divisor}:{height // divisor}"},
+        )
 
     # V2: image_size object + image_config.aspect_ratio
     # NO image_config.image_size preset (that can conflict!)
@@ -70,8 +178,8 @@ def generate_image(api_key, model, image_b64, mime, prompt, width, height):
             ]
         }],
         "max_tokens": 4096,
-        "image_size": {"width": width, "height": height},
-        "image_config": {"aspect_ratio": aspect_ratio}
+        "image_size": size_config[0],
+        "image_config": size_config[1]
     }
 
     # GUARDRAIL: Verify no conflicting image_config.image_size preset
@@ -79,35 +187,63 @@ def generate_image(api_key, model, image_b64, mime, prompt, width, height):
         print("GUARDRAIL FAIL: Payload contains conflicting image_config.image_size preset")
         sys.exit(1)
 
-    response = requests.post(
-        OPENROUTER_API_URL,
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-            "HTTP-Referer": "https://sprite-forge.app",
-            "X-Title": "SPRITE FORGE Dimension Test"
-        },
-        json=payload,
-        timeout=180
-    )
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+    if orjson is not None:
+        response = _get_session().post(
+            OPENROUTER_API_URL, headers=headers,
+            data=orjson.dumps(payload), timeout=180
+        )
+    else:
+        response = _get_session().post(
+            OPENROUTER_API_URL, headers=headers,
+            json=payload, timeout=180
+        )
 
     if not response.ok:
         print(f"API Error: {response.status_code} - {response.text[:200]}")
         return None
 
-    msg = response.json().get("choices", [{}])[0].get("message", {})
-    imgs = msg.get("images", [])
+    if orjson is not None:
+        data = orjson.loads(response.content)
+    else:
+        data = response.json()
+
+    try:
+        msg = data["choices"][0]["message"]
+    except (KeyError, IndexError):
+        return None
 
-    if imgs and "image_url" in imgs[0]:
-        url = imgs[0]["image_url"]["url"]
+    if imgs := msg.get("images"):
+        try:
+            url = imgs[0]["image_url"]["url"]
+        except (KeyError, TypeError):
+            # TypeError: image_url may arrive as a plain string.
+            return None
         if url.startswith("data:"):
             return url.split(",", 1)[1]
 
     return None
 
 
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
 def get_image_dimensions(filepath):
-    """Get dimensions from image file."""
+    """Get dimensions from image file.
+
+    PNG stores width/height as big-endian uint32s at bytes 16-23 of the
+    IHDR chunk, so the common case is a 24-byte read with no Pillow
+    import. Anything that isn't a PNG falls back to PIL.
+    """
+    with open(filepath, "rb") as f:
+        header = f.read(24)
+
+    if header[:8] == _PNG_SIGNATURE and header[12:16] == b"IHDR":
+        return struct.unpack(">II", header[16:24])
+
     try:
         from PIL import Image
         with Image.open(filepath) as img:
@@ -128,7 +264,7 @@ def run_test(skip_generation=False):
     output_dir.mkdir(exist_ok=True)
 
     results = []
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    suffix = _output_suffix()
 
     if not skip_generation:
         # Load environment
@@ -147,48 +283,61 @@ def run_test(skip_generation=False):
             sys.exit(2)
 
         mime, _ = mimetypes.guess_type(str(photo))
-        img_b64 = base64.b64encode(open(photo, "rb").read()).decode()
+        with open(photo, "rb") as f:
+            # mmap skips a full-file-size heap copy for multi-MB photos.
+            if os.fstat(f.fileno()).st_size >= _MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    img_b64 = _b64encode_str(mm)
+            else:
+                img_b64 = _b64encode_str(f.read())
 
         prompt = "Transform this photo into 16-bit pixel art. Output: pure pixel art only."
 
-        # Test CARD
-        from math import gcd
-        card_div = gcd(CARD_WIDTH, CARD_HEIGHT)
-        card_ar = f"{CARD_WIDTH // card_div}:{CARD_HEIGHT // card_div}"
         print(f"\nGenerating CARD ({CARD_WIDTH}x{CARD_HEIGHT})...")
         print(f"  Payload: image_size={{ width: {CARD_WIDTH}, height: {CARD_HEIGHT} }}")
-        print(f"  Payload: image_config={{ aspect_ratio: '{card_ar}' }}")
+        print(f"  Payload: image_config={{ aspect_ratio: '{CARD_AR}' }}")
         print(f"  Payload: image_config.image_size = NOT SET (no conflicting preset)")
 
-        card_b64 = generate_image(api_key, model, img_b64, mime, prompt, CARD_WIDTH, CARD_HEIGHT)
+        print(f"\nGenerating SCENE ({SCENE_WIDTH}x{SCENE_HEIGHT})...")
+        print(f"  Payload: image_size={{ width: {SCENE_WIDTH}, height: {SCENE_HEIGHT} }}")
+        print(f"  Payload: image_config={{ aspect_ratio: '{SCENE_AR}' }}")
+        print(f"  Payload: image_config.image_size = NOT SET (no conflicting preset)")
+
+        # Independent API calls — run CARD and SCENE in parallel so the
+        # test takes max(t_card, t_scene) instead of their sum.
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            card_future = pool.submit(
+                generate_image, api_key, model, img_b64, mime, prompt,
+                CARD_WIDTH, CARD_HEIGHT)
+            scene_future = pool.submit(
+                generate_image, api_key, model, img_b64, mime, prompt,
+                SCENE_WIDTH, SCENE_HEIGHT)
+            card_b64 = card_future.result()
+            scene_b64 = scene_future.result()
+
         if card_b64:
-            card_path = output_dir / f"guardrail_card_{timestamp}.png"
-            open(card_path, "wb").write(base64.b64decode(card_b64))
+            card_path = output_dir / f"guardrail_card_{suffix}.png"
+            _decode_b64_to_file(card_b64, card_path)
             results.append(("CARD", card_path, CARD_WIDTH, CARD_HEIGHT))
         else:
             print("  CARD generation FAILED")
             results.append(("CARD", None, CARD_WIDTH, CARD_HEIGHT))
 
-        # Test SCENE
-        scene_div = gcd(SCENE_WIDTH, SCENE_HEIGHT)
-        scene_ar = f"{SCENE_WIDTH // scene_div}:{SCENE_HEIGHT // scene_div}"
-        print(f"\nGenerating SCENE ({SCENE_WIDTH}x{SCENE_HEIGHT})...")
-        print(f"  Payload: image_size={{ width: {SCENE_WIDTH}, height: {SCENE_HEIGHT} }}")
-        print(f"  Payload: image_config={{ aspect_ratio: '{scene_ar}' }}")
-        print(f"  Payload: image_config.image_size = NOT SET (no conflicting preset)")
-
-        scene_b64 = generate_image(api_key, model, img_b64, mime, prompt, SCENE_WIDTH, SCENE_HEIGHT)
         if scene_b64:
-            scene_path = output_dir / f"guardrail_scene_{timestamp}.png"
-            open(scene_path, "wb").write(base64.b64decode(scene_b64))
+            scene_path = output_dir / f"guardrail_scene_{suffix}.png"
+            _decode_b64_to_file(scene_b64, scene_path)
             results.append(("SCENE", scene_path, SCENE_WIDTH, SCENE_HEIGHT))
         else:
             print("  SCENE generation FAILED")
             results.append(("SCENE", None, SCENE_WIDTH, SCENE_HEIGHT))
     else:
-        # Quick mode: check most recent files
-        card_files = sorted(output_dir.glob("guardrail_card_*.png"), reverse=True)
-        scene_files = sorted(output_dir.glob("guardrail_scene_*.png"), reverse=True)
+        # Quick mode: check most recent files. Sort by mtime, not name —
+        # directories can mix old strftime names with epoch ones, and
+        # the strftime names would win a lexicographic sort forever.
+        card_files = sorted(output_dir.glob("guardrail_card_*.png"),
+                            key=lambda p: p.stat().st_mtime, reverse=True)
+        scene_files = sorted(output_dir.glob("guardrail_scene_*.png"),
+                             key=lambda p: p.stat().st_mtime, reverse=True)
 
         if card_files:
             results.append(("CARD", card_files[0], CARD_WIDTH, CARD_HEIGHT))